@@ -1,41 +1,88 @@
+import sys
 import time
-import subprocess
+import multiprocessing
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# make `autosub` importable when run from the repo root (python scripts/monitor_and_process.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
 WATCH_DIR = Path("examples").resolve()
 SUPPORTED_EXTS = {".mp4", ".mkv", ".wav", ".mp3", ".mov"}
+MODEL = "medium"
+DEVICE = "cuda"
+LANGUAGE = None  # e.g. "en" to skip per-file language detection
+ALIGN_LANGUAGE = LANGUAGE or "en"
+
+def worker(queue):
+    """
+    Long-lived transcription worker: loads the whisper + align models once,
+    then processes media paths from the queue until it receives None.
+    """
+    from autosub import transcribe_accurate as ta
+
+    ta.setup_logging()
+    compute_type = ta.DEFAULT_COMPUTE_TYPES.get(DEVICE, "int8_float16")
+    ta.logger.info("[worker] loading model=%s device=%s compute_type=%s", MODEL, DEVICE, compute_type)
+    model = ta.load_whisper_model(MODEL, DEVICE, compute_type)
+    ta.load_align_model_cached(ALIGN_LANGUAGE, DEVICE)
+    ta.warmup(model, ALIGN_LANGUAGE, DEVICE)
+    ta.logger.info("[worker] models loaded, waiting for files...")
+
+    while True:
+        path = queue.get()
+        if path is None:
+            break
+        input_path = Path(path)
+        ta.logger.info("[worker] processing: %s", input_path.name)
+        try:
+            audio = ta.load_audio(str(input_path))
+            srt_file = input_path.parent / f"{input_path.stem}.srt"
+            vtt_file = input_path.parent / f"{input_path.stem}.vtt"
+            ta.transcribe_align_and_write(audio, model, str(srt_file), str(vtt_file), language=LANGUAGE, device=DEVICE)
+            ta.logger.info("✅ Done: %s %s", srt_file, vtt_file)
+        except Exception:
+            ta.logger.exception("[worker] transcription failed for %s:", input_path)
 
 class FileHandler(FileSystemEventHandler):
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+
     def on_created(self, event):
         if event.is_directory:
             return
         path = Path(event.src_path)
         if path.suffix.lower() in SUPPORTED_EXTS:
             print(f"[+] New file detected: {path.name}")
-            cmd = [
-                "python", "-m", "src.autosub.transcribe_accurate",
-                "--input", str(path),
-                "--model", "medium",
-                "--device", "cuda"
-            ]
-            print("Running:", " ".join(cmd))
-            subprocess.Popen(cmd)
+            self.queue.put(str(path))
 
 def main():
     WATCH_DIR.mkdir(exist_ok=True)
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=worker, args=(queue,), daemon=True)
+    proc.start()
+
     observer = Observer()
-    event_handler = FileHandler()
+    event_handler = FileHandler(queue)
     observer.schedule(event_handler, str(WATCH_DIR), recursive=False)
     observer.start()
     print(f"👀 Watching {WATCH_DIR} for new media files...")
     try:
         while True:
             time.sleep(1)
+            if not proc.is_alive():
+                # e.g. model load failed; queued files would otherwise be dropped silently
+                print(f"[ERROR] transcription worker exited (exitcode={proc.exitcode}); stopping", file=sys.stderr)
+                observer.stop()
+                observer.join()
+                sys.exit(1)
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    queue.put(None)
+    proc.join()
 
 if __name__ == "__main__":
     main()
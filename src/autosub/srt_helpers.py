@@ -1,13 +1,9 @@
-from datetime import timedelta
-
 def seconds_to_srt_timestamp(seconds: float) -> str:
-    td = timedelta(seconds=seconds)
-    total_seconds = int(td.total_seconds())
-    hours = total_seconds // 3600
-    minutes = (total_seconds % 3600) // 60
-    secs = total_seconds % 60
-    milliseconds = int((td.total_seconds() - total_seconds) * 1000)
-    return f"{hours:02}:{minutes:02}:{secs:02},{milliseconds:03}"
+    ms = int(round(seconds * 1000))
+    hours, ms = divmod(ms, 3_600_000)
+    minutes, ms = divmod(ms, 60_000)
+    secs, ms = divmod(ms, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02},{ms:03}"
 
 def segments_to_srt(segments: list) -> str:
     lines = []
@@ -19,3 +15,23 @@ def segments_to_srt(segments: list) -> str:
         lines.append(seg.get("text", "").strip())
         lines.append("")
     return "\n".join(lines)
+
+def segments_to_srt_and_vtt(segments: list, start: int = 1, vtt_header: bool = True) -> tuple:
+    """
+    Build (srt, vtt) in one pass, formatting each timestamp once for both.
+    start and vtt_header let callers emit a long transcript chunk by chunk.
+    """
+    srt_lines = []
+    vtt_lines = ["WEBVTT", ""] if vtt_header else []
+    for i, seg in enumerate(segments, start=start):
+        start_ts = seconds_to_srt_timestamp(seg["start"])
+        end_ts = seconds_to_srt_timestamp(seg["end"])
+        text = seg.get("text", "").strip()
+        srt_lines.append(str(i))
+        srt_lines.append(f"{start_ts} --> {end_ts}")
+        srt_lines.append(text)
+        srt_lines.append("")
+        vtt_lines.append(f"{start_ts.replace(',', '.')} --> {end_ts.replace(',', '.')}")
+        vtt_lines.append(text)
+        vtt_lines.append("")
+    return "\n".join(srt_lines), "\n".join(vtt_lines)
@@ -3,114 +3,276 @@
 Accurate transcription pipeline (debug-friendly).
 
 - Uses whisperx (faster_whisper backend) for alignment.
-- On CPU runners, forces compute_type=float32 to avoid fp16 errors.
-- Writes detailed transcribe.log and prints paths/sizes so CI can find outputs.
+- Defaults to int8 quantization (int8 on CPU, int8_float16 on GPU) for
+  CTranslate2 throughput; override with --compute-type.
+- Logs to stdout and transcribe.log (via the "autosub" logger) with paths/sizes
+  so CI can find outputs; -v adds per-step debug detail.
 """
 import argparse
+import logging
 import os
 import subprocess
-import tempfile
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
-import torch
+import numpy as np
 
-# whisperx import (may wrap faster_whisper)
-import whisperx
+# torch and whisperx (which wraps faster_whisper) take ~1s to import, so they are
+# imported inside the functions that need them; `--help` and argument errors stay fast.
 
-from autosub.srt_helpers import seconds_to_srt_timestamp
+from autosub.srt_helpers import segments_to_srt_and_vtt
 
 LOG_PATH = Path("transcribe.log")
 
-def log(msg: str):
-    print(msg)
+# decoding options passed down to faster_whisper; greedy decoding is ~2-3x faster
+# than the default beam of 5, and not conditioning on previous text avoids
+# repetition loops on long audio. whisperx always runs VAD before decoding.
+ASR_OPTIONS = {"beam_size": 1, "best_of": 1, "condition_on_previous_text": False}
+
+# default compute_type per device: int8 weights on CPU, int8 weights with fp16
+# activations on GPU (~half the VRAM of float16 at similar latency)
+DEFAULT_COMPUTE_TYPES = {"cpu": "int8", "cuda": "int8_float16"}
+
+# segments decoded per batch by whisperx's batched faster_whisper pipeline
+BATCH_SIZE = 16
+
+# transcribed segments aligned (and written out) per chunk, so word-level
+# alignment data for long audio never has to be held all at once
+ALIGN_CHUNK_SIZE = 50
+
+# (align_model, metadata, device) keyed by (language, requested device);
+# loading one is a ~1 GB checkpoint read
+_ALIGN_CACHE = {}
+
+logger = logging.getLogger("autosub")
+
+def setup_logging(verbose: bool = False):
+    """
+    Send the "autosub" logger to stdout and transcribe.log, once per process.
+    Debug lines (audio decode, subtitle writes) are only emitted with verbose.
+    """
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    if logger.handlers:
+        return
+    logger.addHandler(logging.StreamHandler(sys.stdout))
     try:
-        with LOG_PATH.open("a", encoding="utf-8") as fh:
-            fh.write(msg + "\n")
+        logger.addHandler(logging.FileHandler(LOG_PATH, encoding="utf-8"))
     except Exception:
         pass
 
-def extract_audio(input_path: str, out_audio: str):
-    log(f"[extract_audio] extracting from: {input_path} -> {out_audio}")
-    cmd = ["ffmpeg", "-y", "-i", input_path, "-ac", "1", "-ar", "16000", "-vn", out_audio]
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    log(f"[extract_audio] ffmpeg returncode={res.returncode}")
+SAMPLE_RATE = 16000
+
+def load_audio(input_path: str) -> np.ndarray:
+    """
+    Decode input to 16 kHz mono float32 samples by piping ffmpeg straight into memory.
+    Avoids writing and re-reading a temporary WAV file; whisperx accepts the array directly.
+    """
+    logger.debug("[load_audio] decoding from: %s", input_path)
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", input_path,
+        "-ac", "1", "-ar", str(SAMPLE_RATE), "-vn", "-f", "f32le", "-",
+    ]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    logger.debug("[load_audio] ffmpeg returncode=%s", res.returncode)
     if res.returncode != 0:
-        log("[extract_audio] ffmpeg stderr:")
+        logger.error("[load_audio] ffmpeg stderr:")
         try:
-            log(res.stderr.decode("utf-8", errors="replace"))
+            logger.error(res.stderr.decode("utf-8", errors="replace"))
         except Exception:
-            log("<could not decode ffmpeg stderr>")
-        raise RuntimeError("ffmpeg failed to extract audio")
-    log("[extract_audio] audio extraction OK")
+            logger.error("<could not decode ffmpeg stderr>")
+        raise RuntimeError("ffmpeg failed to decode audio")
+    # frombuffer over bytes is read-only; whisperx hands the array to torch.from_numpy
+    audio = np.frombuffer(res.stdout, dtype=np.float32).copy()
+    logger.debug("[load_audio] audio decoding OK (%.1fs)", audio.shape[0] / SAMPLE_RATE)
+    return audio
 
-def transcribe_and_align(audio_path: str, model_name: str = "medium", device: str = "cpu", compute_type: str = "float32"):
+def load_whisper_model(model_name: str, device: str, compute_type: str, threads: int = None):
     """
-    Load whisperx (faster_whisper backend) with explicit compute_type and transcribe+align.
-    compute_type: "float32" | "float16" | "int8" (int8 depends on ctranslate2 build)
+    Load the whisperx (faster_whisper backend) model with the pipeline's decoding options.
+    threads: CPU threads for ctranslate2; defaults to all cores (faster_whisper's own default is 4)
     """
-    log(f"[transcribe_and_align] loading model='{model_name}' device='{device}' compute_type='{compute_type}'")
+    import whisperx
     # whisperx.load_model accepts compute_type and passes down to faster_whisper / ctranslate2
-    model = whisperx.load_model(model_name, device=device, compute_type=compute_type)
-    log("[transcribe_and_align] whisper model loaded")
-    log("[transcribe_and_align] running initial transcription (may take time)...")
-    result = model.transcribe(audio_path)
-    log("[transcribe_and_align] initial transcription complete")
-    log("[transcribe_and_align] loading align model (cpu) ...")
-    align_model, metadata = whisperx.load_align_model(result["language"], device="cpu")
-    log("[transcribe_and_align] running alignment (cpu) ...")
-    aligned = whisperx.align(result["segments"], align_model, metadata, audio_path, device="cpu")
-    log("[transcribe_and_align] alignment complete")
-    return aligned
+    return whisperx.load_model(
+        model_name,
+        device=device,
+        compute_type=compute_type,
+        asr_options=ASR_OPTIONS,
+        threads=threads or os.cpu_count() or 4,
+    )
+
+def load_align_model_cached(language: str, device: str = "cpu"):
+    """
+    Return (align_model, metadata, device) for language, loading it only on first use.
+    Falls back to cpu if the model cannot be placed on device (e.g. VRAM OOM);
+    the returned device is where the model actually lives.
+    """
+    import whisperx
+    key = (language, device)
+    if key not in _ALIGN_CACHE:
+        logger.info("[load_align_model_cached] loading align model for '%s' (%s) ...", language, device)
+        try:
+            align_model, metadata = whisperx.load_align_model(language, device=device)
+        except RuntimeError:
+            if device == "cpu":
+                raise
+            logger.warning("[load_align_model_cached] could not load on %s, falling back to cpu", device)
+            align_model, metadata = whisperx.load_align_model(language, device="cpu")
+            device = "cpu"
+        _ALIGN_CACHE[key] = (align_model, metadata, device)
+    return _ALIGN_CACHE[key]
 
-def write_srt(segments, path: str):
-    log(f"[write_srt] writing srt to: {path}")
-    with open(path, "w", encoding="utf-8") as f:
-        for i, seg in enumerate(segments, start=1):
-            start = seconds_to_srt_timestamp(seg["start"])
-            end = seconds_to_srt_timestamp(seg["end"])
-            text = seg.get("text", "").strip()
-            f.write(f"{i}\n{start} --> {end}\n{text}\n\n")
+def warmup(model, language: str = "en", device: str = "cpu"):
+    """
+    Run the models once on 1s of silence so kernel selection / autotuning happens
+    at startup rather than on the first real file. Results are discarded.
+    whisperx skips decoding when VAD finds no speech, so the encoder is exercised
+    through detect_language instead.
+    """
+    import whisperx
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    logger.info("[warmup] warming up models (%s) ...", device)
     try:
-        log(f"[write_srt] wrote {path} ({os.path.getsize(path)} bytes)")
-    except Exception:
-        log(f"[write_srt] wrote {path} (size unknown)")
-
-def write_vtt(segments, path: str):
-    log(f"[write_vtt] writing vtt to: {path}")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("WEBVTT\n\n")
-        for seg in segments:
-            start = seconds_to_srt_timestamp(seg["start"]).replace(",", ".")
-            end = seconds_to_srt_timestamp(seg["end"]).replace(",", ".")
-            text = seg.get("text", "").strip()
-            f.write(f"{start} --> {end}\n{text}\n\n")
+        model.transcribe(silence, batch_size=1, language=language)
+        model.detect_language(silence)
+        align_model, metadata, align_device = load_align_model_cached(language, device)
+        whisperx.align([{"start": 0.0, "end": 1.0, "text": "warmup"}], align_model, metadata, silence, device=align_device)
+    except Exception as e:
+        logger.warning("[warmup] skipped (%s)", e)
+        return
+    logger.info("[warmup] warmup complete")
+
+def transcribe(audio, model, language: str = None, batch_size: int = BATCH_SIZE):
+    """
+    First (whisper) pass with an already-loaded model.
+    Lets long-lived workers pay the model load cost once instead of per file.
+    Passing a known language skips the extra encoder pass for language detection.
+    """
+    logger.info("[transcribe] running initial transcription (may take time)...")
+    result = model.transcribe(audio, batch_size=batch_size, language=language)
+    logger.info("[transcribe] initial transcription complete (%s segments)", len(result["segments"]))
+    return result
+
+def iter_aligned_chunks(audio, result, device: str = "cpu", speakers: bool = False, chunk_size: int = ALIGN_CHUNK_SIZE):
+    """
+    Yield aligned segments chunk_size transcribed segments at a time, so aligned
+    results for long audio are never materialized in full. The align model comes
+    from the per-language cache and runs on device.
+    speakers: label segments with speaker ids (see label_speakers)
+    """
+    import whisperx
+    segments = result["segments"]
+    align_model, metadata, align_device = load_align_model_cached(result["language"], device)
+    diarize_segments = run_diarization(audio, device) if speakers else None
+    logger.info("[align] aligning (%s) in chunks of %s", align_device, chunk_size)
+    for lo in range(0, len(segments), chunk_size):
+        aligned = whisperx.align(segments[lo:lo + chunk_size], align_model, metadata, audio, device=align_device)
+        if diarize_segments is not None:
+            aligned = label_speakers(diarize_segments, aligned)
+        yield aligned["segments"]
+    logger.info("[align] alignment complete")
+
+def write_subtitles(chunks, srt_path: str, vtt_path: str):
+    """
+    Append each chunk of aligned segments to .part siblings of srt_path/vtt_path and
+    move them into place only once every chunk is written; on failure the
+    temporary files are removed and any existing subtitles are left untouched.
+    """
+    srt_tmp = srt_path + ".part"
+    vtt_tmp = vtt_path + ".part"
+    logger.debug("[write_subtitles] writing srt to: %s and vtt to: %s", srt_path, vtt_path)
+    index = 1
     try:
-        log(f"[write_vtt] wrote {path} ({os.path.getsize(path)} bytes)")
-    except Exception:
-        log(f"[write_vtt] wrote {path} (size unknown)")
+        with open(srt_tmp, "w", encoding="utf-8") as srt_f, open(vtt_tmp, "w", encoding="utf-8") as vtt_f:
+            vtt_f.write("WEBVTT\n\n")
+            for segments in chunks:
+                if not segments:
+                    continue
+                srt_part, vtt_part = segments_to_srt_and_vtt(segments, start=index, vtt_header=False)
+                srt_f.write(srt_part + "\n")
+                vtt_f.write(vtt_part + "\n")
+                index += len(segments)
+            srt_size = srt_f.tell()
+            vtt_size = vtt_f.tell()
+        os.replace(srt_tmp, srt_path)
+        os.replace(vtt_tmp, vtt_path)
+    except BaseException:
+        for tmp in (srt_tmp, vtt_tmp):
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+        raise
+    logger.info("[write_subtitles] wrote %s subtitles: %s (%s bytes) and %s (%s bytes)", index - 1, srt_path, srt_size, vtt_path, vtt_size)
+
+def transcribe_align_and_write(audio, model, srt_path: str, vtt_path: str, language: str = None, device: str = "cpu", speakers: bool = False, batch_size: int = BATCH_SIZE, chunk_size: int = ALIGN_CHUNK_SIZE):
+    """
+    Full pipeline with an already-loaded whisper model: transcribe, then align and
+    write .srt/.vtt chunk by chunk (see iter_aligned_chunks / write_subtitles).
+    """
+    result = transcribe(audio, model, language=language, batch_size=batch_size)
+    chunks = iter_aligned_chunks(audio, result, device=device, speakers=speakers, chunk_size=chunk_size)
+    write_subtitles(chunks, srt_path, vtt_path)
+
+def run_diarization(audio, device: str = "cpu"):
+    """
+    Run pyannote speaker diarization over the whole audio.
+    Reads the Hugging Face token for the pyannote models from $HF_TOKEN.
+    """
+    try:
+        from whisperx.diarize import DiarizationPipeline
+    except ImportError as e:
+        raise RuntimeError("diarization requested but whisperx.diarize / pyannote.audio is not installed") from e
+    logger.info("[diarize] running speaker diarization (%s) ...", device)
+    diarize_model = DiarizationPipeline(use_auth_token=os.environ.get("HF_TOKEN"), device=device)
+    diarize_segments = diarize_model(audio)
+    logger.info("[diarize] diarization complete")
+    return diarize_segments
+
+def label_speakers(diarize_segments, aligned):
+    """Assign speakers to aligned segments and prefix their text with the speaker id."""
+    import whisperx
+    aligned = whisperx.assign_word_speakers(diarize_segments, aligned)
+    for seg in aligned["segments"]:
+        speaker = seg.get("speaker")
+        if speaker:
+            seg["text"] = f"[{speaker}] {seg.get('text', '').strip()}"
+    return aligned
 
 def safe_path_info(p: Path):
+    # single stat() call; a missing file is the exceptional case
     try:
-        return f"{p} exists={p.exists()} size={p.stat().st_size if p.exists() else 'n/a'}"
+        st = p.stat()
+    except FileNotFoundError:
+        return f"{p} exists=False size=n/a"
     except Exception as e:
         return f"{p} exists=ERROR ({e})"
+    return f"{p} exists=True size={st.st_size}"
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", "-i", required=True, help="Input video/audio file")
     parser.add_argument("--model", default="medium", help="Whisper model (tiny, base, small, medium, large)")
-    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="Device for model inference")
-    parser.add_argument("--compute-type", default=None, help="compute type for faster_whisper/whisperx (float16/float32/int8)")
+    parser.add_argument("--device", default=None, help="Device for model inference (default: cuda if available, else cpu)")
+    parser.add_argument("--compute-type", default=None, help="compute type for faster_whisper/whisperx (int8/int8_float16/float16/float32)")
+    parser.add_argument("--language", default=None, help="Spoken language code (e.g. en); skips auto-detection when set")
+    parser.add_argument("--diarize", action="store_true", help="Label subtitles with speaker ids (requires pyannote.audio and $HF_TOKEN)")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for inference (default: all cores)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log per-step debug detail")
     args = parser.parse_args()
+    setup_logging(args.verbose)
+
+    if args.device is None:
+        import torch
+        args.device = "cuda" if torch.cuda.is_available() else "cpu"
 
-    # Choose compute_type: force float32 on CPU to avoid fp16 issues
     compute_type = args.compute_type
     if compute_type is None:
-        compute_type = "float32" if args.device == "cpu" else "float16"
+        compute_type = DEFAULT_COMPUTE_TYPES.get(args.device, "int8_float16")
 
-    log("="*80)
-    log(f"[main] Starting transcription. Args: input={args.input} model={args.model} device={args.device} compute_type={compute_type}")
+    logger.info("=" * 80)
+    logger.info("[main] Starting transcription. Args: input=%s model=%s device=%s compute_type=%s language=%s diarize=%s", args.input, args.model, args.device, compute_type, args.language, args.diarize)
     try:
         input_path = Path(args.input)
         if not input_path.exists():
@@ -119,32 +281,28 @@ def main():
         output_dir = input_path.parent
         base = input_path.stem
 
-        log(f"[main] input file info: {safe_path_info(input_path)}")
-        with tempfile.TemporaryDirectory() as tmpdir:
-            audio_path = Path(tmpdir) / "audio.wav"
-            log(f"[main] temp audio will be: {audio_path}")
-
-            # extract audio
-            extract_audio(str(input_path), str(audio_path))
-            log(f"[main] audio file info: {safe_path_info(audio_path)}")
-
-            # transcribe & align
-            aligned = transcribe_and_align(str(audio_path), model_name=args.model, device=args.device, compute_type=compute_type)
+        logger.info("[main] input file info: %s", safe_path_info(input_path))
+        # decode audio while the model loads; ffmpeg runs in its own process and
+        # model loading is mostly native code, so the two overlap well
+        logger.info("[main] loading model='%s' device='%s' compute_type='%s' alongside audio decode", args.model, args.device, compute_type)
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            fut_audio = ex.submit(load_audio, str(input_path))
+            fut_model = ex.submit(load_whisper_model, args.model, args.device, compute_type, args.threads)
+            audio = fut_audio.result()
+            model = fut_model.result()
+        logger.info("[main] whisper model loaded")
 
-            # write outputs next to input file
-            srt_file = output_dir / f"{base}.srt"
-            vtt_file = output_dir / f"{base}.vtt"
+        # transcribe, then align & write outputs next to input file
+        srt_file = output_dir / f"{base}.srt"
+        vtt_file = output_dir / f"{base}.vtt"
 
-            log(f"[main] will write srt to: {srt_file}")
-            write_srt(aligned["segments"], str(srt_file))
-            write_vtt(aligned["segments"], str(vtt_file))
+        transcribe_align_and_write(audio, model, str(srt_file), str(vtt_file), language=args.language, device=args.device, speakers=args.diarize)
 
-            log(f"[main] final files: {safe_path_info(srt_file)} ; {safe_path_info(vtt_file)}")
-            print(f"✅ Done: {srt_file} {vtt_file}")
+        logger.info("[main] final files: %s ; %s", safe_path_info(srt_file), safe_path_info(vtt_file))
+        print(f"✅ Done: {srt_file} {vtt_file}")
 
     except Exception:
-        log("[main] Exception occurred:")
-        log(traceback.format_exc())
+        logger.exception("[main] Exception occurred:")
         print("[ERROR] transcription failed; see transcribe.log for details", file=sys.stderr)
         sys.exit(2)
 